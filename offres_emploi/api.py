@@ -1,17 +1,40 @@
+import asyncio
+import concurrent.futures
 import datetime
+import importlib.util
+import threading
 import time
 import re
 
 import requests
 from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
 from requests.exceptions import HTTPError
 
+try:
+    import httpx
+except ImportError:  # optional dependency, only required by the async methods
+    httpx = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # optional dependency, faster than the standard library
+    from json import loads as json_loads
+
+# HTTP/2 support of httpx relies on the 'h2' package
+HTTP2_AVAILABLE = httpx is not None and importlib.util.find_spec("h2") is not None
+
 # CONSTANTS
 ENDPOINT_ACCESS_TOKEN = "https://entreprise.pole-emploi.fr/connexion/oauth2/access_token"
 OFFRES_DEMPLOI_V2_BASE = "https://api.emploi-store.fr/partenaire/offresdemploi/v2"
 REFERENTIEL_ENDPOINT = "{}/referentiel".format(OFFRES_DEMPLOI_V2_BASE)
 SEARCH_ENDPOINT = "{}/offres/search".format(OFFRES_DEMPLOI_V2_BASE)
+TOKEN_EXPIRY_MARGIN = 30  # in seconds
+
+_CONTENT_RANGE_RE = re.compile(
+    r"offres (?P<first_index>\d+)-(?P<last_index>\d+)/(?P<max_results>\d+)"
+)
 
 
 class Api:
@@ -64,10 +87,37 @@ class Api:
             ),  # 429 for too many requests and 502 for bad gateway
             respect_retry_after_header=False,
         )
-        adapter = HTTPAdapter(max_retries=retry)
+        # Pool large enough for the threads of 'search_parallel'
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=16)
         session.mount("http://", adapter)
         session.mount("https://", adapter)
+        self._retry = retry  # also applied by the async methods
         self.session = session
+        # The 'referentiels' are reference tables that rarely change: they are requested
+        # once per instance
+        self._referentiels = {}
+        # Serialises the token refresh between the threads of 'search_parallel' (and
+        # the tasks of the async methods)
+        self._token_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks and the async client (bound to an event loop) cannot be pickled, and the
+        # monotonic expiry deadline is meaningless in another process: the token is
+        # requested again after unpickling
+        state = self.__dict__.copy()
+        for attr in (
+            "_token_lock",
+            "_async_client",
+            "_async_loop",
+            "_expires_monotonic",
+            "_headers",
+        ):
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._token_lock = threading.Lock()
 
     def get_token(self):
         """
@@ -88,10 +138,15 @@ class Api:
                 self.client_id
             ),
         )
-        headers = {"content-type": "application/x-www-form-urlencoded"}
+        # The Authorization header of the session is only meant for the API
+        headers = {
+            "content-type": "application/x-www-form-urlencoded",
+            "Authorization": None,
+        }
         params = dict(realm="/partenaire")
         current_time = datetime.datetime.today()
-        r = requests.post(
+        current_monotonic = time.monotonic()
+        r = self.session.post(
             url=ENDPOINT_ACCESS_TOKEN,
             headers=headers,
             data=data,
@@ -103,27 +158,42 @@ class Api:
             r.raise_for_status()
         except HTTPError as error:
             if r.status_code == 400:
-                complete_message = str(error) + "\n" + str(r.json())
+                try:
+                    details = json_loads(r.content)
+                except ValueError:
+                    details = r.text
+                complete_message = str(error) + "\n" + str(details)
                 raise HTTPError(complete_message)
             else:
                 raise error
         else:
-            token = r.json()
+            token = json_loads(r.content)
             token["expires_at"] = current_time + datetime.timedelta(
                 seconds=token["expires_in"]
             )
             self.token = token
+            self._headers = {"Authorization": "Bearer " + token["access_token"]}
+            self.session.headers.update(self._headers)
+            # Monotonic clock is immune to system clock changes, and the token is
+            # considered expired slightly before its actual expiration (the margin is
+            # capped so that a short-lived token is not expired as soon as it is issued)
+            margin = min(TOKEN_EXPIRY_MARGIN, token["expires_in"] / 2)
+            self._expires_monotonic = current_monotonic + token["expires_in"] - margin
             return token
 
     def is_expired(self):
         """
-        Test if the broken as expired (based on the 'expires_at' field)
+        Test if the token has expired (or will in less than TOKEN_EXPIRY_MARGIN seconds, or half its lifetime if shorter), based on a monotonic clock.
+        A token that has never been requested is considered expired.
 
         :rtype: boolean
         :returns: True if the token has expired, False otherwise
 
         """
-        expired = datetime.datetime.today() >= self.token["expires_at"]
+        expired = (
+            not hasattr(self, "_expires_monotonic")
+            or time.monotonic() >= self._expires_monotonic
+        )
         return expired
 
     def get_headers(self):
@@ -131,18 +201,20 @@ class Api:
         :rtype: dict
         :returns: The headers necessary to do requests. Will ask a new token if it has expired since or it has never been requested
         """
-        if not hasattr(self, "token"):
-            if self.verbose:
-                print("Token has not been requested yet. Requesting token")
-            self.get_token()
-        elif self.is_expired():
-            if self.verbose:
-                print("Token is expired. Requesting new token")
-            self.get_token()
-        headers = {
-            "Authorization": "Bearer {}".format(self.token["access_token"])
-        }
-        return headers
+        self._ensure_token()
+        return self._headers
+
+    def _ensure_token(self):
+        """
+        Request a new token (also bound to the session headers) if it has expired or has never been requested
+        """
+        if self.is_expired():
+            with self._token_lock:
+                # Another thread may have refreshed the token while this one was waiting
+                if self.is_expired():
+                    if self.verbose:
+                        print("Token is missing or expired. Requesting token")
+                    self.get_token()
 
     def referentiel(self, referentiel):
         """
@@ -153,6 +225,8 @@ class Api:
 
         Full list available at: https://www.emploi-store-dev.fr/portail-developpeur-cms/home/catalogue-des-api/documentation-des-api/api/api-offres-demploi-v2/referentiels.html
 
+        The output is cached on the instance, so the 'referentiel' is requested only once. The returned object is shared between calls and should not be modified.
+
         :param referentiel: The 'referentiel' to look for
         :type referentiel: str
         :raises HTTPError: Error when requesting the ressource
@@ -163,12 +237,20 @@ class Api:
         
         >>> client.referentiel("themes")
 
+        """
+        if referentiel not in self._referentiels:
+            self._referentiels[referentiel] = self._fetch_referentiel(referentiel)
+        return self._referentiels[referentiel]
+
+    def _fetch_referentiel(self, referentiel):
+        """
+        Request the 'referentiel' from the API (see :meth:`referentiel`, that caches its output)
         """
         referentiel_endpoint = "{}/{}".format(REFERENTIEL_ENDPOINT, referentiel)
 
+        self._ensure_token()
         r = self.session.get(
             url=referentiel_endpoint,
-            headers=self.get_headers(),
             timeout=self.timeout,
             proxies=self.proxies,
         )
@@ -177,7 +259,7 @@ class Api:
         except Exception as e:
             raise e
         else:
-            return r.json()
+            return json_loads(r.content)
 
     def search(self, params=None, silent_http_errors=False):
         """
@@ -206,10 +288,10 @@ class Api:
         """
         if self.verbose:
             print('Making request with params {}'.format(params))
+        self._ensure_token()
         r = self.session.get(
             url=SEARCH_ENDPOINT,
             params=params,
-            headers=self.get_headers(),
             timeout=self.timeout,
             proxies=self.proxies,
         )
@@ -217,22 +299,267 @@ class Api:
         try:
             r.raise_for_status()
         except HTTPError as error:
-            if r.status_code == 400:
-                complete_message = str(error) + "\n" + r.json()["message"]
-                if silent_http_errors:
-                    print(complete_message)
-                else:
-                    raise HTTPError(complete_message)
+            self._handle_search_error(error, r, silent_http_errors)
+        else:
+            return self._search_output(r)
+
+    def search_parallel(
+        self, params=None, ranges=(), max_workers=8, silent_http_errors=False
+    ):
+        """
+        Make one search per range, the requests being sent concurrently from a pool of threads.
+
+        Keep in mind that the API limit rate is 3 requests per second.
+
+        :param params: The parameters shared by all the search requests (without 'range')
+        :type param: dict
+        :param ranges: The ranges to request, as (first_index, last_index) pairs
+        :type ranges: iterable of tuple
+        :param max_workers: The maximum number of threads. Default is 8
+        :type max_workers: int
+        :param silent_http_errors: Silent HTTP errors if True, raise error otherwise. Default is False
+        :type silent_http_errors: bool
+
+        :raises HTTPError: Error when requesting the ressource
+
+        :rtype: list
+        :returns: The outputs of the searches (see :meth:`search`), in the same order as 'ranges'
+
+        :Example:
+        >>> ranges = [(0, 149), (150, 299), (300, 449)]
+        >>> client.search_parallel(params={"motsCles": "Ouvrier"}, ranges=ranges)
+        """
+        page_params = self._range_params(params, ranges)
+        # Request the token once beforehand rather than from every thread
+        self._ensure_token()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(
+                    lambda p: self.search(params=p, silent_http_errors=silent_http_errors),
+                    page_params,
+                )
+            )
+
+    async def async_search(self, params=None, silent_http_errors=False):
+        """
+        Asynchronous version of :meth:`search`, to be awaited. Requires the optional dependency 'httpx'.
+
+        The underlying ``httpx.AsyncClient`` is created on first use and kept on the instance so that its connections are reused.
+        It is bound to the running event loop and should be closed with :meth:`aclose` before the loop ends, which ``async with client:`` does
+        (a client left open is dropped when the async methods are next used from another loop, once its own loop is closed).
+        HTTP/2 is negotiated when the 'h2' package is installed, in which case the concurrent requests are multiplexed on a single connection.
+
+        :param params: The parameters of the search request
+        :type param: dict
+        :param silent_http_errors: Silent HTTP errors if True, raise error otherwise. Default is False
+        :type silent_http_errors: bool
+
+        :raises HTTPError: Error when requesting the ressource
+        :raises requests.exceptions.RequestException: ConnectionError or Timeout when the API cannot be reached, as :meth:`search`
+
+        :rtype: dict
+        :returns: Same output as :meth:`search`
+
+        :Example:
+        >>> import asyncio
+        >>> async def main():
+        ...     async with client:
+        ...         return await client.async_search(params={"motsCles": "Ouvrier"})
+        >>> asyncio.run(main())
+        """
+        return await self._async_search(
+            self._get_async_client(), params, silent_http_errors
+        )
+
+    async def _async_search(self, client, params, silent_http_errors):
+        """
+        Implementation of :meth:`async_search`, sending the request with the given ``httpx.AsyncClient``
+        """
+        if self.verbose:
+            print('Making request with params {}'.format(params))
+        # Same retry policy as the session (429 and 502 with backoff), httpx only
+        # retrying failed connections
+        retry = self._retry
+        while True:
+            headers = await self._async_get_headers()
+            # Raise the same exceptions as the session
+            try:
+                r = await client.get(
+                    url=SEARCH_ENDPOINT, params=params, headers=headers
+                )
+            except httpx.ConnectTimeout as error:
+                raise requests.exceptions.ConnectTimeout(str(error)) from error
+            except httpx.TimeoutException as error:
+                raise requests.exceptions.Timeout(str(error)) from error
+            except httpx.HTTPError as error:
+                raise requests.exceptions.ConnectionError(str(error)) from error
+            if r.status_code not in retry.status_forcelist:
+                break
+            try:
+                retry = retry.increment(method="GET", url=str(r.url))
+            except MaxRetryError:
+                break
+            await asyncio.sleep(retry.get_backoff_time())
+
+        try:
+            r.raise_for_status()
+        except httpx.HTTPStatusError as error:
+            self._handle_search_error(error, r, silent_http_errors)
+        else:
+            return self._search_output(r)
+
+    async def search_all(
+        self, params=None, ranges=(), max_concurrency=3, silent_http_errors=False
+    ):
+        """
+        Make concurrently one search per range, as :meth:`async_search` does for a single one.
+
+        Keep in mind that the API limit rate is 3 requests per second: at most 'max_concurrency' requests are in flight at once,
+        and the requests rejected with code 429 are retried with backoff.
+
+        The searches are sent with their own client, closed once they are done, so concurrent calls do not interfere.
+
+        :param params: The parameters shared by all the search requests (without 'range')
+        :type param: dict
+        :param ranges: The ranges to request, as (first_index, last_index) pairs
+        :type ranges: iterable of tuple
+        :param max_concurrency: The maximum number of simultaneous requests. Default is 3
+        :type max_concurrency: int
+        :param silent_http_errors: Silent HTTP errors if True, raise error otherwise. Default is False
+        :type silent_http_errors: bool
+
+        :raises HTTPError: Error when requesting the ressource
+
+        :rtype: list
+        :returns: The outputs of the searches (see :meth:`search`), in the same order as 'ranges'
+
+        :Example:
+        >>> import asyncio
+        >>> ranges = [(0, 149), (150, 299), (300, 449)]
+        >>> asyncio.run(client.search_all(params={"motsCles": "Ouvrier"}, ranges=ranges))
+        """
+        page_params = self._range_params(params, ranges)
+        async with self._new_async_client() as client:
+            # Request the token once beforehand rather than from every concurrent task
+            await self._async_get_headers()
+            semaphore = asyncio.Semaphore(max_concurrency)
+
+            async def search_page(p):
+                async with semaphore:
+                    return await self._async_search(client, p, silent_http_errors)
+
+            return await asyncio.gather(*[search_page(p) for p in page_params])
+
+    async def aclose(self):
+        """
+        Close the connections opened by the async methods.
+        """
+        if getattr(self, "_async_client", None) is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_loop = None
+
+    async def __aenter__(self):
+        self._get_async_client()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def _get_async_client(self):
+        """
+        :rtype: httpx.AsyncClient
+        :returns: The client used by the async methods, created if it does not exist yet
+
+        :raises RuntimeError: If the client is still open in another event loop that is running
+        """
+        loop = asyncio.get_event_loop()
+        opened = getattr(self, "_async_client", None) is not None
+        if opened and self._async_loop is not loop:
+            if not self._async_loop.is_closed():
+                raise RuntimeError(
+                    "The async client is open in another event loop. Close it with "
+                    "'await client.aclose()' (or use 'async with client:') before the loop ends"
+                )
+            # Left open by a previous loop (e.g. asyncio.run(client.async_search())), its
+            # connections cannot be used anymore
+            self._async_client = None
+            opened = False
+        if not opened:
+            self._async_client = self._new_async_client()
+            self._async_loop = loop
+        return self._async_client
+
+    def _new_async_client(self):
+        """
+        :rtype: httpx.AsyncClient
+        :returns: A new client configured as the session (timeout, proxies), negotiating HTTP/2 when available
+        """
+        if httpx is None:
+            raise ImportError(
+                "The async methods require 'httpx'. Install it with: pip install httpx"
+            )
+        mounts = {
+            "{}://".format(scheme): httpx.AsyncHTTPTransport(
+                http2=HTTP2_AVAILABLE,
+                proxy=proxy if "://" in proxy else "http://{}".format(proxy),
+            )
+            for (scheme, proxy) in (self.proxies or {}).items()
+        }
+        return httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=self.timeout,
+            transport=httpx.AsyncHTTPTransport(http2=HTTP2_AVAILABLE, retries=3),
+            mounts=mounts,
+        )
+
+    async def _async_get_headers(self):
+        """
+        Async counterpart of :meth:`get_headers`: the token is refreshed in a thread, and only once when several tasks
+        find it expired (see :meth:`_ensure_token`).
+
+        :rtype: dict
+        """
+        if self.is_expired():
+            await asyncio.get_event_loop().run_in_executor(None, self._ensure_token)
+        return self._headers
+
+    @staticmethod
+    def _range_params(params, ranges):
+        """
+        :rtype: list
+        :returns: A copy of 'params' for each range, with the 'range' parameter set
+        """
+        params = params or {}
+        return [
+            dict(params, range="{}-{}".format(first, last)) for (first, last) in ranges
+        ]
+
+    @staticmethod
+    def _handle_search_error(error, r, silent_http_errors):
+        """
+        Print the error of a search request if 'silent_http_errors' is True, raise it as an HTTPError otherwise
+        """
+        if r.status_code == 400:
+            complete_message = str(error) + "\n" + json_loads(r.content)["message"]
+            if silent_http_errors:
+                print(complete_message)
             else:
-                if silent_http_errors:
-                    print(str(error))
-                else:
-                    raise error
+                raise HTTPError(complete_message)
         else:
-            found_range = re.search(
-                pattern="offres (?P<first_index>\d+)-(?P<last_index>\d+)/(?P<max_results>\d+)",
-                string=r.headers["Content-Range"],
-            ).groupdict()
-            out = r.json()
-            out.update({"Content-Range": found_range})
-            return out
+            if silent_http_errors:
+                print(str(error))
+            elif isinstance(error, HTTPError):
+                raise error
+            else:
+                raise HTTPError(str(error))
+
+    @staticmethod
+    def _search_output(r):
+        """
+        :returns: The JSON content of a search response with the parsed 'Content-Range' header
+        """
+        found_range = _CONTENT_RANGE_RE.search(r.headers["Content-Range"]).groupdict()
+        out = json_loads(r.content)
+        out.update({"Content-Range": found_range})
+        return out
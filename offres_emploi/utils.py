@@ -12,9 +12,9 @@ def dt_to_str_iso(dt):
     :returns: ISO 8601 formatted string
     :rtype: str       
     """
-    iso_format = "%Y-%m-%dT%H:%M:%SZ"
     if isinstance(dt, datetime.datetime):
-        s = dt.strftime(iso_format)
+        # Same output as dt.strftime("%Y-%m-%dT%H:%M:%SZ"), without parsing the format
+        s = f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}T{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}Z"
         return s
     else:
         raise ValueError("Arg 'dt' should be of class 'datetime.datetime'")
@@ -29,18 +29,11 @@ def filters_to_df(filters):
     :returns: A pandas.DataFrame of the filters (that is more suitable to analysis)
 
     """
-    dics = [{x["filtre"]: x["agregation"]} for x in filters]
-    l = []
-    for dic in dics:
-        flat_dic = [
-            dict(
-                filtre=key,
-                valeur_possible=x["valeurPossible"],
-                nb_resultats=x["nbResultats"],
-            )
-            for (key, value) in dic.items()
-            for x in value
-        ]
-        l.extend(flat_dic)
-    df = pd.DataFrame(l)
+    df = (
+        pd.json_normalize(filters, record_path="agregation", meta="filtre")
+        .rename(
+            columns={"valeurPossible": "valeur_possible", "nbResultats": "nb_resultats"}
+        )
+        .reindex(columns=["filtre", "valeur_possible", "nb_resultats"])
+    )
     return df
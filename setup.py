@@ -19,4 +19,9 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     python_requires='>=3.6',
+    extras_require={
+        "async": ["httpx[http2]"],
+        "orjson": ["orjson"],
+        "brotli": ["brotli"],
+    },
 )